@@ -1,21 +1,32 @@
 import os
 import re
+import asyncio
 import io
 import json
 import logging
 import datetime
 import csv
 import uuid
-from tempfile import NamedTemporaryFile
-from typing import List, Tuple, Optional, Dict
-from collections import Counter
+import hashlib
+from tempfile import SpooledTemporaryFile, mkstemp
+from typing import List, Tuple, Optional, Dict, Union, NamedTuple, FrozenSet, Iterator, Any
+from collections import Counter, OrderedDict
+from operator import itemgetter
 import math
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import unicodedata
-from difflib import SequenceMatcher
+import numpy as np
+from rapidfuzz import fuzz
+from sklearn.feature_extraction.text import TfidfVectorizer
+from cachetools import LRUCache, TTLCache
 
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
-from telegram import Update
+from telegram import Update, PhotoSize
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 # Setup logging dengan format yang lebih detail
@@ -31,12 +42,153 @@ DATASET_ID = os.getenv("DATASET_ID")
 TABLE_ID = os.getenv("TABLE_ID")
 TABLE_REF = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
+# Lokasi file kredensial service account (ditulis sekali saat startup)
+SERVICE_ACCOUNT_PATH = "/tmp/sa.json"
+
 # OCR.Space API Key
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY")
+OCR_API_URL = 'https://api.ocr.space/parse/image'
+
+# Foto lebih kecil dari ini (sticker, gambar kosong) tidak dikirim ke OCR
+MIN_OCR_FILE_SIZE = 2048
+MIN_OCR_PIXELS = 10_000
+PHOTO_TOO_SMALL_MESSAGE = (
+    "❌ Gambar terlalu kecil untuk dibaca.\n"
+    "Kirim ulang foto yang lebih besar dan jelas."
+)
+
+# Session HTTP bersama untuk OCR.Space (reuse koneksi TLS + retry otomatis)
+_ocr_session = requests.Session()
+_ocr_session.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['POST'])
+    )
+))
 
 # Global clients
 bq_client = None
 
+# Pool koneksi HTTP BigQuery, cukup untuk query paralel dari worker thread
+BQ_HTTP_POOL_SIZE = 20
+BQ_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# Jumlah kandidat teratas yang diambil untuk similarity scoring
+SIMILARITY_CANDIDATE_LIMIT = 20
+
+# Teks query tetap; nilai dari user selalu lewat query parameter
+COUNT_SOAL_SQL = f"SELECT COUNT(*) as count FROM `{TABLE_REF}` LIMIT 1"
+
+MERGE_SOAL_SQL = f"""
+MERGE `{TABLE_REF}` T
+USING (
+    SELECT @question AS question,
+           @question_normalized AS question_normalized,
+           @answer AS answer, @source AS source
+) S
+ON T.question_normalized = S.question_normalized
+WHEN NOT MATCHED THEN
+    INSERT (id, question, question_normalized, answer, source, timestamp)
+    VALUES (GENERATE_UUID(), S.question, S.question_normalized, S.answer, S.source, CURRENT_TIMESTAMP())
+"""
+
+# Import massal: MERGE dari tabel staging hasil load job
+MERGE_STAGING_SQL = f"""
+MERGE `{TABLE_REF}` T
+USING `{{staging_table}}` S
+ON T.question_normalized = S.question_normalized
+WHEN NOT MATCHED THEN
+    INSERT (id, question, question_normalized, answer, source, timestamp)
+    VALUES (S.id, S.question, S.question_normalized, S.answer, S.source, S.timestamp)
+"""
+
+# Jawaban yang benar-benar tersimpan untuk baris di tabel staging (setelah MERGE)
+STORED_STAGING_SQL = f"""
+SELECT T.question_normalized, T.answer
+FROM `{TABLE_REF}` T
+JOIN `{{staging_table}}` S USING (question_normalized)
+"""
+
+# Tabel staging kedaluwarsa sendiri jika proses mati sebelum sempat menghapusnya
+STAGING_TABLE_EXPIRATION = datetime.timedelta(hours=1)
+
+# Skema tabel soal, dipakai untuk tabel staging import massal
+SOAL_SCHEMA = [
+    bigquery.SchemaField("id", "STRING"),
+    bigquery.SchemaField("question", "STRING"),
+    bigquery.SchemaField("question_normalized", "STRING"),
+    bigquery.SchemaField("answer", "STRING"),
+    bigquery.SchemaField("source", "STRING"),
+    bigquery.SchemaField("timestamp", "TIMESTAMP"),
+]
+
+EXACT_MATCH_SQL = f"""
+SELECT answer
+FROM `{TABLE_REF}`
+WHERE CONTAINS_SUBSTR(question_normalized, @question_normalized)
+LIMIT 1
+"""
+
+SIMILARITY_CANDIDATES_SQL = f"""
+SELECT answer, question_normalized,
+       (SELECT COUNT(*) FROM UNNEST(SPLIT(question_normalized, ' ')) AS token
+        WHERE token IN UNNEST(@words)) AS hits
+FROM `{TABLE_REF}`
+WHERE EXISTS (SELECT 1 FROM UNNEST(SPLIT(question_normalized, ' ')) AS token
+              WHERE token IN UNNEST(@words))
+ORDER BY hits DESC
+LIMIT {SIMILARITY_CANDIDATE_LIMIT}
+"""
+
+KEYWORD_SEARCH_SQL = f"""
+SELECT answer, question_normalized,
+       SEARCH(question_normalized, @search_pattern) as search_score
+FROM `{TABLE_REF}`
+WHERE SEARCH(question_normalized, @search_pattern) > 0
+ORDER BY search_score DESC
+LIMIT 30
+"""
+
+# Index TF-IDF seluruh bank soal di memori, di-refresh berkala di background
+CORPUS_REFRESH_INTERVAL = 600
+CORPUS_SQL = f"SELECT answer, question_normalized FROM `{TABLE_REF}`"
+_corpus_index = None
+_corpus_refresh_task = None
+
+# question_normalized -> answer untuk exact match tanpa BigQuery
+_exact_index: Dict[str, str] = {}
+
+# Cache hasil OCR per hash isi gambar (gambar yang dikirim ulang tidak di-OCR lagi)
+OCR_CACHE_SIZE = 2048
+_ocr_cache = LRUCache(maxsize=OCR_CACHE_SIZE)
+_ocr_cache_lock = threading.Lock()
+
+# Cache jawaban per question_normalized; TTL agar soal baru tetap terbaca
+ANSWER_CACHE_SIZE = 8192
+ANSWER_CACHE_TTL = 3600
+_answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+_answer_cache_lock = threading.Lock()
+
+# Pesan dari find_answer_from_question yang bukan jawaban
+DATABASE_UNAVAILABLE_MESSAGE = "Database tidak tersedia. Silakan coba lagi nanti."
+QUESTION_TOO_SHORT_MESSAGE = "Pertanyaan terlalu pendek. Silakan berikan pertanyaan yang lebih lengkap."
+ANSWER_NOT_FOUND_MESSAGE = "Jawaban tidak ditemukan. Coba reformulasi pertanyaan Anda atau periksa ejaan."
+SEARCH_ERROR_MESSAGE = "Terjadi kesalahan saat mencari jawaban. Silakan coba lagi nanti."
+NON_ANSWER_MESSAGES = frozenset({
+    DATABASE_UNAVAILABLE_MESSAGE,
+    QUESTION_TOO_SHORT_MESSAGE,
+    ANSWER_NOT_FOUND_MESSAGE,
+    SEARCH_ERROR_MESSAGE,
+})
+
+# Cache semantik untuk pertanyaan hasil OCR (teks OCR sedikit berbeda tiap gambar)
+OCR_ANSWER_CACHE_SIZE = 512
+OCR_ANSWER_CACHE_MIN_SIMILARITY = 0.85
+
 # Stopwords yang disederhanakan - hanya kata yang benar-benar tidak penting
 STOPWORDS = {
     'adalah', 'itu', 'ini', 'tersebut', 'oleh', 'sebuah', 'sebagai',
@@ -63,6 +215,47 @@ QUESTION_PATTERNS = {
     'kecuali': ['kecuali', 'bukan', 'tidak termasuk', 'selain', 'except']
 }
 
+# Standardisasi kontraksi umum untuk normalize_for_search
+CONTRACTIONS = {
+    'gimana': 'bagaimana',
+    'kenapa': 'mengapa',
+    'kapankah': 'kapan',
+    'siapakah': 'siapa',
+    'apakah': 'apa',
+    'yg': 'yang',
+    'dgn': 'dengan',
+    'spt': 'seperti',
+    'utk': 'untuk',
+    'sdh': 'sudah',
+    'tdk': 'tidak',
+    'blm': 'belum',
+    'krn': 'karena',
+    'jg': 'juga',
+    'dkk': 'dan kawan-kawan',
+    'dll': 'dan lain-lain'
+}
+CONTRACTION_PATTERN = re.compile(r'\b(?:' + '|'.join(CONTRACTIONS) + r')\b')
+
+# Karakter selain huruf, angka, spasi, dan simbol matematika
+# Pertahankan: + - * / = ( ) [ ] { } < > ^ %
+NON_SEARCH_CHAR_PATTERN = re.compile(r'[^\w\s\+\-\*\/\=\(\)\[\]\{\}\<\>\^\%]')
+
+# Kata kunci nama kolom pertanyaan/jawaban pada header CSV
+QUESTION_COLUMN_KEYWORDS = ('question', 'soal', 'pertanyaan', 'ask')
+ANSWER_COLUMN_KEYWORDS = ('answer', 'jawaban', 'kunci', 'solusi', 'solution')
+
+# Spasi berulang (dipakai di setiap normalisasi teks)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Deteksi ekspresi matematika pada teks
+MATH_PATTERN = re.compile(r'[0-9+\-*/=^%]')
+
+# Pasangan Q:/A: pada file teks, di-compile sekali saat import
+QA_PATTERN = re.compile(
+    r'(?:Q:|Pertanyaan:|Soal:)\s*(.*?)(?=(?:\n\s*(?:A:|Jawaban:)|\Z))(?:\s*(?:A:|Jawaban:)\s*(.*))?',
+    re.IGNORECASE | re.DOTALL
+)
+
 # =======================
 # SETUP BIGQUERY
 # =======================
@@ -73,24 +266,39 @@ def initialize_services():
     try:
         service_account_info = os.getenv("SERVICE_ACCOUNT_JSON")
         if service_account_info:
-            with NamedTemporaryFile(mode='w', delete=False, suffix='.json') as temp_file:
-                json.dump(json.loads(service_account_info), temp_file)
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = temp_file.name
+            # Tulis sekali secara atomik; tidak perlu parse/serialize ulang JSON
+            if not os.path.exists(SERVICE_ACCOUNT_PATH):
+                # Nama temp unik di direktori yang sama agar proses paralel tidak bertabrakan
+                fd, temp_path = mkstemp(dir=os.path.dirname(SERVICE_ACCOUNT_PATH), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, 'w') as temp_file:
+                        temp_file.write(service_account_info)
+                    os.replace(temp_path, SERVICE_ACCOUNT_PATH)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = SERVICE_ACCOUNT_PATH
         else:
             logger.warning("SERVICE_ACCOUNT_JSON tidak ditemukan di environment variables")
         
-        bq_client = bigquery.Client(project=PROJECT_ID)
+        # Satu AuthorizedSession dengan pool koneksi bersama untuk semua query
+        credentials, _ = google.auth.default(scopes=BQ_SCOPES)
+        http_session = AuthorizedSession(credentials)
+        http_session.mount("https://", HTTPAdapter(
+            pool_connections=BQ_HTTP_POOL_SIZE,
+            pool_maxsize=BQ_HTTP_POOL_SIZE
+        ))
+        
+        bq_client = bigquery.Client(project=PROJECT_ID, credentials=credentials, _http=http_session)
         logger.info("BigQuery client berhasil diinisialisasi")
         
         # Test koneksi BigQuery
-        test_query = f"SELECT COUNT(*) as count FROM `{TABLE_REF}` LIMIT 1"
-        query_job = bq_client.query(test_query)
-        results = list(query_job.result())
-        logger.info(f"Test koneksi BigQuery berhasil. Jumlah data: {results[0].count}")
+        row = next(iter(bq_client.query_and_wait(COUNT_SOAL_SQL, max_results=1)))
+        logger.info("Test koneksi BigQuery berhasil. Jumlah data: %s", row.count)
             
         return bq_client
     except Exception as e:
-        logger.error(f"Gagal menginisialisasi services: {e}")
+        logger.error("Gagal menginisialisasi services: %s", e)
         raise
 
 def clean_text(text: str) -> str:
@@ -106,12 +314,12 @@ def clean_text(text: str) -> str:
         text = ''.join(char for char in text if char.isprintable() or char.isspace())
         
         # Standardisasi spasi
-        text = re.sub(r'\s+', ' ', text)
+        text = WHITESPACE_PATTERN.sub(' ', text)
         
         # Hapus leading/trailing whitespace
         return text.strip()
     except Exception as e:
-        logger.error(f"Error cleaning text: {e}")
+        logger.error("Error cleaning text: %s", e)
         return str(text).strip() if text else ""
 
 def normalize_for_search(text: str) -> str:
@@ -124,39 +332,18 @@ def normalize_for_search(text: str) -> str:
         # Ke lowercase
         text = text.lower()
         
-        # Standardisasi kontraksi umum
-        replacements = {
-            'gimana': 'bagaimana',
-            'kenapa': 'mengapa',
-            'kapankah': 'kapan',
-            'siapakah': 'siapa',
-            'apakah': 'apa',
-            'yg': 'yang',
-            'dgn': 'dengan',
-            'spt': 'seperti',
-            'utk': 'untuk',
-            'sdh': 'sudah',
-            'tdk': 'tidak',
-            'blm': 'belum',
-            'krn': 'karena',
-            'jg': 'juga',
-            'dkk': 'dan kawan-kawan',
-            'dll': 'dan lain-lain'
-        }
-        
-        for old, new in replacements.items():
-            text = re.sub(rf'\b{old}\b', new, text)
+        # Standardisasi kontraksi umum (satu pass regex untuk semua kontraksi)
+        text = CONTRACTION_PATTERN.sub(lambda m: CONTRACTIONS[m.group(0)], text)
         
         # Hapus karakter yang bukan huruf, angka, spasi, atau simbol matematika
-        # Pertahankan: + - * / = ( ) [ ] { } < > ^ %
-        text = re.sub(r'[^\w\s\+\-\*\/\=\(\)\[\]\{\}\<\>\^\%]', ' ', text)
+        text = NON_SEARCH_CHAR_PATTERN.sub(' ', text)
         
         # Normalisasi spasi menjadi spasi tunggal
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = WHITESPACE_PATTERN.sub(' ', text).strip()
         
         return text
     except Exception as e:
-        logger.error(f"Error normalizing text: {e}")
+        logger.error("Error normalizing text: %s", e)
         return clean_text(text).lower()
 
 def normalize_math_expression(text: str) -> str:
@@ -180,13 +367,13 @@ def normalize_math_expression(text: str) -> str:
         
         return text
     except Exception as e:
-        logger.error(f"Error normalizing math expression: {e}")
+        logger.error("Error normalizing math expression: %s", e)
         return text
 
-def extract_keywords(text: str) -> List[str]:
+def extract_keywords(text: str, already_normalized: bool = False) -> List[str]:
     """Ekstrak kata kunci dengan pendekatan yang lebih baik"""
     try:
-        normalized = normalize_for_search(text)
+        normalized = text if already_normalized else normalize_for_search(text)
         if not normalized:
             return []
         
@@ -205,48 +392,73 @@ def extract_keywords(text: str) -> List[str]:
         
         return keywords
     except Exception as e:
-        logger.error(f"Error extracting keywords: {e}")
+        logger.error("Error extracting keywords: %s", e)
         return []
 
-def calculate_text_similarity(text1: str, text2: str) -> float:
-    """Hitung similarity dengan penanganan khusus untuk matematika"""
+class TextProfile(NamedTuple):
+    """Representasi teks yang sudah di-tokenisasi untuk similarity"""
+    text: str
+    words: List[str]
+    word_set: FrozenSet[str]
+    question_patterns: FrozenSet[str]
+
+class SimilarityProfile(NamedTuple):
+    """Profil teks yang dihitung sekali lalu dipakai untuk banyak perbandingan"""
+    is_math: bool
+    plain: TextProfile
+    math: Optional[TextProfile]
+
+def build_text_profile(text: str) -> TextProfile:
+    """Tokenisasi teks sekali untuk dipakai berulang"""
+    words = text.split()
+    question_patterns = frozenset(
+        pattern
+        for patterns in QUESTION_PATTERNS.values()
+        for pattern in patterns
+        if pattern in text
+    )
+    return TextProfile(text, words, frozenset(words), question_patterns)
+
+def build_similarity_profile(text: str, with_math: bool = True) -> SimilarityProfile:
+    """Bangun profil similarity; varian matematika hanya jika dibutuhkan"""
+    is_math = bool(MATH_PATTERN.search(text))
+    math_profile = None
+    if is_math and with_math:
+        math_profile = build_text_profile(normalize_math_expression(text))
+    return SimilarityProfile(is_math, build_text_profile(text), math_profile)
+
+def calculate_profile_similarity(profile1: SimilarityProfile, profile2: SimilarityProfile) -> float:
+    """Hitung similarity dari dua profil yang sudah di-tokenisasi"""
     try:
-        # Deteksi apakah teks mengandung ekspresi matematika
-        math_pattern = r'[0-9+\-*/=^%]'
-        is_math1 = bool(re.search(math_pattern, text1))
-        is_math2 = bool(re.search(math_pattern, text2))
-        
         # Jika keduanya ekspresi matematika, gunakan normalisasi khusus
-        if is_math1 and is_math2:
-            text1_norm = normalize_math_expression(text1)
-            text2_norm = normalize_math_expression(text2)
+        both_math = profile1.is_math and profile2.is_math
+        if both_math:
+            text1, text2 = profile1.math, profile2.math
         else:
-            text1_norm = text1
-            text2_norm = text2
+            text1, text2 = profile1.plain, profile2.plain
         
         # Kedua teks sudah dalam format normalized
-        if not text1_norm or not text2_norm:
+        if not text1.text or not text2.text:
             return 0.0
         
         # 1. Exact match check dulu
-        if text1_norm == text2_norm:
+        if text1.text == text2.text:
             return 1.0
         
-        # 2. Sequence similarity untuk keseluruhan
-        seq_similarity = SequenceMatcher(None, text1_norm, text2_norm).ratio()
+        # 2. Sequence similarity untuk keseluruhan (RapidFuzz, implementasi C++)
+        seq_similarity = fuzz.ratio(text1.text, text2.text) / 100.0
         
         # 3. Word-level similarity dengan mempertimbangkan urutan
-        words1 = text1_norm.split()
-        words2 = text2_norm.split()
+        words1 = text1.words
+        words2 = text2.words
         
         if not words1 or not words2:
             return seq_similarity * 0.3
         
         # Hitung word overlap dengan bobot untuk posisi
-        set1, set2 = set(words1), set(words2)
-        intersection = len(set1 & set2)
-        union = len(set1 | set2)
-        word_similarity = intersection / union if union > 0 else 0.0
+        common_words = text1.word_set & text2.word_set
+        union = len(text1.word_set | text2.word_set)
+        word_similarity = len(common_words) / union if union > 0 else 0.0
         
         # Hitung ordered similarity (memperhatikan urutan kata)
         ordered_similarity = 0.0
@@ -265,21 +477,21 @@ def calculate_text_similarity(text1: str, text2: str) -> float:
         len_ratio = min(len(words1), len(words2)) / max(len(words1), len(words2))
         
         # 5. Important word bonus
-        important_matches = (set1 & set2) & IMPORTANT_WORDS
+        important_matches = common_words & IMPORTANT_WORDS
         important_bonus = len(important_matches) * 0.15
         
         # 6. Math expression bonus
         math_bonus = 0.0
-        if is_math1 and is_math2:
+        if both_math:
             math_bonus = 0.2  # Bonus khusus untuk ekspresi matematika
             
         # 7. Question type bonus
+        common_patterns = text1.question_patterns & text2.question_patterns
         question_bonus = 0.0
-        for q_type, patterns in QUESTION_PATTERNS.items():
-            for pattern in patterns:
-                if pattern in text1_norm and pattern in text2_norm:
+        if common_patterns:
+            for patterns in QUESTION_PATTERNS.values():
+                if any(pattern in common_patterns for pattern in patterns):
                     question_bonus += 0.1
-                    break
         
         # Weighted combination dengan bobot yang disesuaikan
         final_score = (
@@ -294,12 +506,12 @@ def calculate_text_similarity(text1: str, text2: str) -> float:
         
         return min(final_score, 1.0)
     except Exception as e:
-        logger.error(f"Error calculating similarity: {e}")
+        logger.error("Error calculating similarity: %s", e)
         return 0.0
 
-def detect_question_type(question: str) -> List[str]:
+def detect_question_type(question: str, already_normalized: bool = False) -> List[str]:
     """Deteksi tipe pertanyaan dengan lebih akurat"""
-    normalized = normalize_for_search(question)
+    normalized = question if already_normalized else normalize_for_search(question)
     detected_types = []
     
     for q_type, patterns in QUESTION_PATTERNS.items():
@@ -335,7 +547,7 @@ def clean_ocr_text(text: str) -> str:
         
         return clean_text(text)
     except Exception as e:
-        logger.error(f"Error cleaning OCR text: {e}")
+        logger.error("Error cleaning OCR text: %s", e)
         return clean_text(text)
 
 # =======================
@@ -343,111 +555,221 @@ def clean_ocr_text(text: str) -> str:
 # =======================
 
 def simpan_soal(question: str, answer: str, source: str = "manual") -> bool:
-    """Simpan soal ke BigQuery dengan validasi yang lebih baik"""
+    """Simpan soal ke BigQuery dengan satu MERGE (cek duplikat + insert atomik)"""
     try:
-        question = clean_text(str(question))
-        answer = clean_text(str(answer))
-        
-        if not question or not answer or len(question) < 3:
-            logger.warning(f"Soal tidak valid: question='{question}', answer='{answer}'")
+        row = build_soal_row(question, answer, source)
+        if row is None:
+            logger.warning("Soal tidak valid: question='%s', answer='%s'", question, answer)
             return False
-
-        question_normalized = normalize_for_search(question)
         
-        if not question_normalized:
-            logger.warning("Question normalized kosong")
+        # Soal yang sudah ada di index tidak perlu MERGE ke BigQuery.
+        # Index bisa tertinggal hingga CORPUS_REFRESH_INTERVAL: soal yang baru
+        # dihapus/diperbaiki langsung di BigQuery tetap ditolak sampai refresh berikutnya
+        if row["question_normalized"] in _exact_index:
+            logger.info("Soal sudah ada di database")
             return False
 
-        # Cek duplikat dengan query yang lebih efisien
-        query = """
-        SELECT COUNT(*) as count 
-        FROM `{0}` 
-        WHERE CONTAINS_SUBSTR(question_normalized, @question_normalized)
-        LIMIT 1
-        """.format(TABLE_REF)
-        
+        # id dan timestamp dibuat di server oleh MERGE
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("question_normalized", "STRING", question_normalized)
+                bigquery.ScalarQueryParameter(name, "STRING", row[name])
+                for name in ("question", "question_normalized", "answer", "source")
             ]
         )
         
-        query_job = bq_client.query(query, job_config=job_config)
-        result = list(query_job.result())[0]
+        query_job = bq_client.query(MERGE_SOAL_SQL, job_config=job_config)
+        query_job.result()
         
-        if result.count > 0:
+        if not query_job.num_dml_affected_rows:
             logger.info("Soal sudah ada di database")
             return False
-
-        # Insert data baru
-        rows_to_insert = [{
-            "id": str(uuid.uuid4()),
-            "question": question,
-            "question_normalized": question_normalized,
-            "answer": answer,
-            "source": source,
-            "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
-        }]
-
-        errors = bq_client.insert_json(TABLE_REF, rows_to_insert)
-        if errors:
-            logger.error(f"Error inserting row: {errors}")
-            return False
         
-        logger.info(f"Soal berhasil disimpan: {question[:50]}...")
+        _exact_index.setdefault(row["question_normalized"], row["answer"])
+        clear_answer_cache()
+        logger.info("Soal berhasil disimpan: %s...", row['question'][:50])
         return True
     except Exception as e:
-        logger.error(f"Error menyimpan soal: {e}")
+        logger.error("Error menyimpan soal: %s", e)
         return False
 
-def find_answer_from_question(question: str) -> str:
+def build_soal_row(question: str, answer: str, source: str) -> Optional[Dict[str, str]]:
+    """Bangun satu baris tabel soal, None jika soal tidak valid"""
+    question = clean_text(str(question))
+    answer = clean_text(str(answer))
+
+    if not question or not answer or len(question) < 3:
+        return None
+
+    question_normalized = normalize_for_search(question)
+    if not question_normalized:
+        return None
+
+    return {
+        "id": str(uuid.uuid4()),
+        "question": question,
+        "question_normalized": question_normalized,
+        "answer": answer,
+        "source": source,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+    }
+
+def merge_soal_rows(rows: List[Dict[str, str]]) -> Tuple[int, Dict[str, str]]:
+    """Load ke tabel staging lalu MERGE; kembalikan jumlah insert dan jawaban yang tersimpan"""
+    if not rows:
+        return 0, {}
+
+    staging_table_id = f"{TABLE_REF}_staging_{uuid.uuid4().hex}"
+    staging_table = bigquery.Table(staging_table_id, schema=SOAL_SCHEMA)
+    staging_table.expires = datetime.datetime.now(datetime.timezone.utc) + STAGING_TABLE_EXPIRATION
+    job_config = bigquery.LoadJobConfig(
+        schema=SOAL_SCHEMA,
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+    )
+
+    try:
+        # Dibuat dulu (kosong, dengan expires) agar load job tidak membuat tabel tanpa kedaluwarsa
+        bq_client.create_table(staging_table)
+        with SpooledTemporaryFile(max_size=10 * 1024 * 1024, mode='w+b') as ndjson_file:
+            for row in rows:
+                ndjson_file.write(json.dumps(row, ensure_ascii=False).encode('utf-8'))
+                ndjson_file.write(b"\n")
+            ndjson_file.seek(0)
+
+            load_job = bq_client.load_table_from_file(ndjson_file, staging_table_id, job_config=job_config)
+            load_job.result()
+
+        # Cek duplikat dan insert dilakukan atomik di server
+        query_job = bq_client.query(MERGE_STAGING_SQL.format(staging_table=staging_table_id))
+        query_job.result()
+
+        # MERGE tidak memberi tahu baris mana yang di-insert dan soal lama tetap memakai
+        # jawaban lamanya, jadi jawaban dibaca ulang selagi tabel staging masih ada
+        stored_answers = {}
+        try:
+            for row in bq_client.query_and_wait(STORED_STAGING_SQL.format(staging_table=staging_table_id)):
+                stored_answers.setdefault(row.question_normalized, row.answer)
+        except Exception as e:
+            # Soal sudah tersimpan; hanya exact index yang tertinggal sampai refresh berikutnya
+            logger.error("Gagal membaca jawaban tersimpan untuk exact index: %s", e)
+    finally:
+        bq_client.delete_table(staging_table_id, not_found_ok=True)
+
+    count_inserted = query_job.num_dml_affected_rows or 0
+    logger.info("MERGE selesai: %s dari %s baris disimpan", count_inserted, load_job.output_rows)
+    return count_inserted, stored_answers
+
+def simpan_soal_bulk(qa_pairs: List[Tuple[str, str]], source: str) -> int:
+    """Simpan banyak soal sekaligus: satu load job ke staging lalu satu MERGE"""
+    try:
+        # Bangun baris dan buang duplikat di dalam batch itu sendiri
+        rows_by_normalized = {}
+        for question, answer in qa_pairs:
+            row = build_soal_row(question, answer, source)
+            if row and row["question_normalized"] not in rows_by_normalized:
+                rows_by_normalized[row["question_normalized"]] = row
+        
+        # Soal yang sudah ada di index dibuang sebelum load job; MERGE tetap jadi penentu.
+        # Iterasi batch lokal saja: cek `in` ke _exact_index aman walau diubah thread lain
+        # (index bisa tertinggal hingga CORPUS_REFRESH_INTERVAL, lihat simpan_soal)
+        for question_normalized in list(rows_by_normalized):
+            if question_normalized in _exact_index:
+                del rows_by_normalized[question_normalized]
+
+        count_success, stored_answers = merge_soal_rows(list(rows_by_normalized.values()))
+        _exact_index.update(stored_answers)
+        if count_success:
+            clear_answer_cache()
+        logger.info("%s dari %s soal berhasil disimpan", count_success, len(qa_pairs))
+        return count_success
+    except Exception as e:
+        logger.error("Error menyimpan soal massal: %s", e)
+        return 0
+
+def find_answer_from_question(question: str, semantic_cache: Optional["SemanticOCRCache"] = None) -> str:
     """Pencarian jawaban dengan algoritma yang diperbaiki"""
     try:
         if bq_client is None:
             logger.error("BigQuery client tidak tersedia")
-            return "Database tidak tersedia. Silakan coba lagi nanti."
+            return DATABASE_UNAVAILABLE_MESSAGE
         
         question = clean_text(question)
         if len(question) < 2:
-            return "Pertanyaan terlalu pendek. Silakan berikan pertanyaan yang lebih lengkap."
+            return QUESTION_TOO_SHORT_MESSAGE
         
         question_normalized = normalize_for_search(question)
-        logger.info(f"Mencari jawaban untuk: '{question}' -> normalized: '{question_normalized}'")
-        
-        # Deteksi tipe pertanyaan
-        question_types = detect_question_type(question)
-        logger.info(f"Tipe pertanyaan: {question_types}")
-        
-        # FASE 1: Exact Match
-        exact_answer = search_exact_match(question_normalized)
-        if exact_answer:
-            logger.info("Ditemukan exact match")
-            return exact_answer
-        
-        # FASE 2: Fuzzy Search dengan Similarity (threshold tinggi)
-        fuzzy_answer = search_with_similarity(question_normalized, threshold=0.75)
-        if fuzzy_answer:
-            logger.info("Ditemukan dengan fuzzy search (high threshold)")
-            return fuzzy_answer
-        
-        # FASE 3: Keyword-based Search
-        keyword_answer = search_with_keywords(question_normalized, question_types)
-        if keyword_answer:
-            logger.info("Ditemukan dengan keyword search")
-            return keyword_answer
-        
-        # FASE 4: Lowered threshold fuzzy search
-        fuzzy_answer_low = search_with_similarity(question_normalized, threshold=0.55)
-        if fuzzy_answer_low:
-            logger.info("Ditemukan dengan fuzzy search (low threshold)")
-            return fuzzy_answer_low
-        
-        logger.info("Jawaban tidak ditemukan di database")
-        return "Jawaban tidak ditemukan. Coba reformulasi pertanyaan Anda atau periksa ejaan."
+        logger.info("Mencari jawaban untuk: '%s' -> normalized: '%s'", question, question_normalized)
+        
+        # Pertanyaan yang sama tidak perlu ke BigQuery lagi
+        with _answer_cache_lock:
+            cached_answer = _answer_cache.get(question_normalized)
+        if cached_answer is not None:
+            logger.info("Jawaban ditemukan di cache")
+            return cached_answer
+        
+        answer = search_answer(question_normalized, semantic_cache)
+        if answer is None:
+            logger.info("Jawaban tidak ditemukan di database")
+            return ANSWER_NOT_FOUND_MESSAGE
+        
+        with _answer_cache_lock:
+            _answer_cache[question_normalized] = answer
+        if semantic_cache is not None:
+            semantic_cache.put(question_normalized, answer)
+        return answer
                 
     except Exception as e:
-        logger.error(f"Error mencari jawaban: {e}", exc_info=True)
-        return "Terjadi kesalahan saat mencari jawaban. Silakan coba lagi nanti."
+        logger.error("Error mencari jawaban: %s", e, exc_info=True)
+        return SEARCH_ERROR_MESSAGE
+
+def search_answer(question_normalized: str, semantic_cache: Optional["SemanticOCRCache"] = None) -> Optional[str]:
+    """Jalankan fase-fase pencarian di BigQuery, None jika tidak ditemukan"""
+    # Normalisasi sudah dilakukan sekali oleh pemanggil, semua fase memakai hasilnya
+    question_types = detect_question_type(question_normalized, already_normalized=True)
+    logger.info("Tipe pertanyaan: %s", question_types)
+    
+    # FASE 1: Exact Match (index di memori dulu, baru BigQuery)
+    exact_answer = _exact_index.get(question_normalized) or search_exact_match(question_normalized)
+    if exact_answer:
+        logger.info("Ditemukan exact match")
+        return exact_answer
+    
+    # Cache semantik (teks OCR) hanya setelah semua exact lookup gagal,
+    # agar tidak pernah menggantikan jawaban persis yang ada di database
+    if semantic_cache is not None:
+        semantic_answer = semantic_cache.get(question_normalized)
+        if semantic_answer is not None:
+            return semantic_answer
+    
+    # Profil dan kata kunci pertanyaan dibangun sekali untuk semua fase
+    question_profile = build_similarity_profile(question_normalized)
+    keywords = extract_keywords(question_normalized, already_normalized=True)
+    
+    # FASE 2: Fuzzy Search dengan Similarity (threshold tinggi)
+    # Kandidat terbaik dihitung sekali, fase 4 cukup memakai ulang skornya
+    fuzzy_match = search_with_similarity(question_normalized, question_profile, keywords)
+    if fuzzy_match and fuzzy_match[1] >= 0.75:
+        logger.info("Ditemukan dengan fuzzy search (high threshold)")
+        return fuzzy_match[0]
+    
+    # FASE 3: Keyword-based Search
+    keyword_answer = search_with_keywords(question_types, question_profile, keywords)
+    if keyword_answer:
+        logger.info("Ditemukan dengan keyword search")
+        return keyword_answer
+    
+    # FASE 4: Lowered threshold fuzzy search
+    if fuzzy_match and fuzzy_match[1] >= 0.55:
+        logger.info("Ditemukan dengan fuzzy search (low threshold)")
+        return fuzzy_match[0]
+    
+    return None
+
+def clear_answer_cache():
+    """Kosongkan cache jawaban setelah ada soal baru"""
+    with _answer_cache_lock:
+        _answer_cache.clear()
+    ocr_answer_cache.clear()
 
 def search_exact_match(question_normalized: str) -> Optional[str]:
     """Pencarian exact match menggunakan CONTAINS_SUBSTR"""
@@ -456,85 +778,72 @@ def search_exact_match(question_normalized: str) -> Optional[str]:
             logger.warning("Question normalized terlalu pendek")
             return None
         
-        query = """
-        SELECT answer 
-        FROM `{0}` 
-        WHERE CONTAINS_SUBSTR(question_normalized, @question_normalized)
-        LIMIT 1
-        """.format(TABLE_REF)
-        
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("question_normalized", "STRING", question_normalized)
             ]
         )
         
-        query_job = bq_client.query(query, job_config=job_config)
-        results = list(query_job.result())
+        results = bq_client.query_and_wait(EXACT_MATCH_SQL, job_config=job_config, max_results=1)
+        row = next(iter(results), None)
         
-        return results[0].answer if results else None
+        return row.answer if row else None
     except Exception as e:
-        logger.error(f"Error dalam exact match search: {e}")
+        logger.error("Error dalam exact match search: %s", e)
         return None
 
-def search_with_similarity(question_normalized: str, threshold: float = 0.7) -> Optional[str]:
-    """Pencarian dengan similarity scoring - optimized untuk database besar"""
+def search_with_similarity(question_normalized: str, question_profile: SimilarityProfile, keywords: List[str]) -> Optional[Tuple[str, float]]:
+    """Kandidat dengan similarity tertinggi sebagai (answer, score), threshold diterapkan pemanggil"""
     try:
-        # Ekstrak kata kunci untuk pre-filtering
-        keywords = extract_keywords(question_normalized)
+        # Kata kunci dipakai untuk pre-filtering
         if not keywords:
             return None
         
-        # Ambil kata kunci terpanjang untuk filtering awal
-        main_keywords = [kw for kw in keywords if len(kw) >= 3]
-        if not main_keywords:
-            main_keywords = keywords[:2]  # Fallback ke 2 kata pertama
-        
-        # Buat pattern untuk REGEXP_CONTAINS
-        patterns = []
-        for kw in main_keywords[:3]:  # Maksimal 3 kata kunci utama
-            patterns.append(f'(?=.*{re.escape(kw)})')
-        
-        pattern = ''.join(patterns)
+        # Kandidat dari index TF-IDF di memori (profil sudah dihitung saat load);
+        # BigQuery hanya jika index belum siap
+        candidates = find_corpus_candidates(question_normalized, SIMILARITY_CANDIDATE_LIMIT)
+        if candidates is None:
+            candidates = fetch_similarity_candidates(keywords, with_math=question_profile.is_math)
         
-        query = f"""
-        SELECT answer, question_normalized 
-        FROM `{TABLE_REF}`
-        WHERE REGEXP_CONTAINS(question_normalized, r'{pattern}')
-        LIMIT 100
-        """
-        
-        query_job = bq_client.query(query)
-        results = list(query_job.result())
-        
-        if not results:
+        # Hanya top-1 yang dibutuhkan: satu pass max(), tanpa sort atau materialisasi list
+        scored = (
+            (answer, calculate_profile_similarity(question_profile, candidate_profile))
+            for candidate_profile, answer in candidates
+        )
+        best_answer, best_score = max(scored, key=itemgetter(1), default=(None, 0.0))
+        if best_answer is None or best_score <= 0:
             return None
         
-        best_match = None
-        best_score = 0
-        
-        # Evaluasi similarity untuk kandidat yang sudah difilter
-        for row in results:
-            score = calculate_text_similarity(question_normalized, row.question_normalized)
-            
-            if score > best_score and score >= threshold:
-                best_score = score
-                best_match = row.answer
-                logger.debug(f"New best match: score={best_score:.3f}")
-        
-        if best_match:
-            logger.info(f"Found similarity match with score: {best_score:.3f}")
-        
-        return best_match
+        logger.info("Best similarity candidate score: %.3f", best_score)
+        return best_answer, best_score
     except Exception as e:
-        logger.error(f"Error dalam similarity search: {e}")
+        logger.error("Error dalam similarity search: %s", e)
         return None
 
-def search_with_keywords(question_normalized: str, question_types: List[str]) -> Optional[str]:
+def fetch_similarity_candidates(keywords: List[str], with_math: bool = True) -> Iterator[Tuple[SimilarityProfile, str]]:
+    """Ambil kandidat (profil, answer) teratas dari BigQuery"""
+    # Ambil kata kunci terpanjang untuk filtering awal
+    main_keywords = [kw for kw in keywords if len(kw) >= 3]
+    if not main_keywords:
+        main_keywords = keywords[:2]  # Fallback ke 2 kata pertama
+    
+    # Ranking kandidat dilakukan di BigQuery berdasarkan jumlah token yang sama,
+    # sehingga hanya top-K baris yang dikirim ke bot
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("words", "STRING", list(dict.fromkeys(main_keywords)))
+        ]
+    )
+    
+    results = bq_client.query_and_wait(SIMILARITY_CANDIDATES_SQL, job_config=job_config)
+    return (
+        (build_similarity_profile(row.question_normalized, with_math=with_math), row.answer)
+        for row in results
+    )
+
+def search_with_keywords(question_types: List[str], question_profile: SimilarityProfile, keywords: List[str]) -> Optional[str]:
     """Pencarian berdasarkan kata kunci menggunakan SEARCH()"""
     try:
-        keywords = extract_keywords(question_normalized)
-        
         if not keywords:
             return None
         
@@ -546,38 +855,26 @@ def search_with_keywords(question_normalized: str, question_types: List[str]) ->
         # Ambil maksimal 5 kata kunci terpenting
         search_keywords = important_keywords[:5]
         
-        logger.info(f"Searching dengan keywords: {search_keywords}")
+        logger.info("Searching dengan keywords: %s", search_keywords)
         
         # Buat pattern untuk SEARCH function
         search_pattern = " ".join(search_keywords)
         
-        query = f"""
-        SELECT answer, question_normalized,
-               SEARCH(question_normalized, @search_pattern) as search_score
-        FROM `{TABLE_REF}`
-        WHERE SEARCH(question_normalized, @search_pattern) > 0
-        ORDER BY search_score DESC
-        LIMIT 30
-        """
-        
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("search_pattern", "STRING", search_pattern)
             ]
         )
         
-        query_job = bq_client.query(query, job_config=job_config)
-        results = list(query_job.result())
-        
-        if not results:
-            return None
+        results = bq_client.query_and_wait(KEYWORD_SEARCH_SQL, job_config=job_config, max_results=15)
         
         # Hitung similarity untuk kandidat terbaik
         best_match = None
         best_score = 0
         
-        for row in results[:15]:  # Evaluasi top 15 candidates
-            score = calculate_text_similarity(question_normalized, row.question_normalized)
+        for row in results:  # Evaluasi top 15 candidates
+            row_profile = build_similarity_profile(row.question_normalized, with_math=question_profile.is_math)
+            score = calculate_profile_similarity(question_profile, row_profile)
             
             # Beri bonus untuk skor search yang lebih tinggi
             search_bonus = row.search_score * 0.05
@@ -589,28 +886,104 @@ def search_with_keywords(question_normalized: str, question_types: List[str]) ->
         
         # Threshold lebih rendah untuk keyword search
         if best_match and best_score >= 0.4:
-            logger.info(f"Found keyword match with score: {best_score:.3f}")
+            logger.info("Found keyword match with score: %.3f", best_score)
             return best_match
         
         return None
     except Exception as e:
-        logger.error(f"Error dalam keyword search: {e}")
+        logger.error("Error dalam keyword search: %s", e)
         return None
 
+# =======================
+# CORPUS INDEX (TF-IDF)
+# =======================
+
+class CorpusIndex(NamedTuple):
+    """Snapshot bank soal di memori untuk pencarian kandidat"""
+    vectorizer: TfidfVectorizer
+    matrix: Any
+    profiles: List[SimilarityProfile]
+    answers: List[str]
+
+def refresh_corpus_index() -> int:
+    """Muat seluruh bank soal dari BigQuery dan bangun matriks TF-IDF"""
+    global _corpus_index, _exact_index
+    questions = []
+    answers = []
+    exact_index = {}
+    for row in bq_client.query_and_wait(CORPUS_SQL):
+        if row.question_normalized and row.answer:
+            questions.append(row.question_normalized)
+            answers.append(row.answer)
+            exact_index.setdefault(row.question_normalized, row.answer)
+    
+    _exact_index = exact_index
+    if not questions:
+        _corpus_index = None
+        return 0
+    
+    # Token dipisah spasi, sama seperti question_normalized di database
+    vectorizer = TfidfVectorizer(token_pattern=r'\S+', dtype=np.float32)
+    matrix = vectorizer.fit_transform(questions)
+    
+    # Tokenisasi tiap soal sekali saat load, bukan di setiap pencarian
+    profiles = [build_similarity_profile(question) for question in questions]
+    
+    # Ganti snapshot secara atomik; pembaca lama tetap memakai snapshot sebelumnya
+    _corpus_index = CorpusIndex(vectorizer, matrix, profiles, answers)
+    return len(questions)
+
+def find_corpus_candidates(question_normalized: str, limit: int) -> Optional[List[Tuple[SimilarityProfile, str]]]:
+    """Kandidat (profil, answer) dengan cosine TF-IDF tertinggi, None jika index belum siap"""
+    index = _corpus_index
+    if index is None:
+        return None
+    
+    query_vector = index.vectorizer.transform([question_normalized])
+    if query_vector.nnz == 0:
+        return []
+    
+    # Baris matriks sudah dinormalisasi L2, jadi dot product = cosine similarity
+    scores = (index.matrix @ query_vector.T).toarray().ravel()
+    limit = min(limit, scores.shape[0])
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top])]
+    
+    return [(index.profiles[i], index.answers[i]) for i in top if scores[i] > 0]
+
+async def refresh_corpus_periodically():
+    """Refresh index TF-IDF di background setiap CORPUS_REFRESH_INTERVAL detik"""
+    while True:
+        try:
+            count = await asyncio.to_thread(refresh_corpus_index)
+            logger.info("Index TF-IDF diperbarui: %s soal", count)
+        except Exception as e:
+            logger.error("Gagal memperbarui index TF-IDF: %s", e)
+        await asyncio.sleep(CORPUS_REFRESH_INTERVAL)
+
 # =======================
 # OCR FUNCTIONS
 # =======================
 
-def ocr_with_ocr_space(image_content: bytes) -> str:
+def is_photo_too_small(photo: PhotoSize) -> bool:
+    """Cek dari metadata Telegram, sebelum download dan OCR"""
+    if photo.file_size is not None and photo.file_size < MIN_OCR_FILE_SIZE:
+        return True
+    return bool(photo.width and photo.height) and photo.width * photo.height < MIN_OCR_PIXELS
+
+def ocr_with_ocr_space(image_content: Union[bytes, bytearray]) -> str:
     """OCR dengan OCR.Space API"""
     try:
         if not image_content or len(image_content) < 100:
             logger.warning("Ukuran gambar terlalu kecil untuk OCR")
             return ""
         
-        with NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            temp_file.write(image_content)
-            temp_file_path = temp_file.name
+        image_hash = hashlib.blake2b(image_content, digest_size=16).digest()
+        with _ocr_cache_lock:
+            cached_text = _ocr_cache.get(image_hash)
+        if cached_text is not None:
+            logger.info("Hasil OCR diambil dari cache")
+            return cached_text
         
         # Gunakan language code yang valid untuk OCR.Space
         payload = {
@@ -622,25 +995,23 @@ def ocr_with_ocr_space(image_content: bytes) -> str:
             'isTable': False    # Tidak dalam format tabel
         }
         
-        with open(temp_file_path, 'rb') as f:
-            files = {'file': (temp_file_path, f, 'image/jpeg')}
-            response = requests.post(
-                'https://api.ocr.space/parse/image',
-                files=files,
-                data=payload,
-                timeout=30
-            )
-        
-        os.unlink(temp_file_path)
+        # Kirim isi gambar langsung dari memori, tanpa file sementara
+        files = {'file': ('image.jpg', image_content, 'image/jpeg')}
+        response = _ocr_session.post(
+            OCR_API_URL,
+            files=files,
+            data=payload,
+            timeout=30
+        )
         
         if response.status_code != 200:
-            logger.error(f"OCR.Space HTTP error: {response.status_code}")
+            logger.error("OCR.Space HTTP error: %s", response.status_code)
             return ""
         
         try:
             result = response.json()
         except json.JSONDecodeError as e:
-            logger.error(f"OCR.Space JSON decode error: {e}")
+            logger.error("OCR.Space JSON decode error: %s", e)
             return ""
         
         if result.get('OCRExitCode') == 1:
@@ -649,19 +1020,90 @@ def ocr_with_ocr_space(image_content: bytes) -> str:
                 raw_text = parsed_results[0].get('ParsedText', '')
                 if raw_text:
                     cleaned_text = clean_ocr_text(raw_text)
-                    logger.info(f"OCR.Space berhasil: '{raw_text[:50]}...' -> '{cleaned_text[:50]}...'")
+                    logger.info("OCR.Space berhasil: '%s...' -> '%s...'", raw_text[:50], cleaned_text[:50])
+                    if cleaned_text:
+                        with _ocr_cache_lock:
+                            _ocr_cache[image_hash] = cleaned_text
                     return cleaned_text
         else:
             error_message = result.get('ErrorMessage', ['Unknown error'])
             if isinstance(error_message, list):
                 error_message = ', '.join(error_message)
-            logger.error(f"OCR.Space error: {error_message}")
+            logger.error("OCR.Space error: %s", error_message)
             
         return ""
     except Exception as e:
-        logger.error(f"Error dalam OCR.Space: {e}")
+        logger.error("Error dalam OCR.Space: %s", e)
         return ""
 
+class SemanticOCRCache:
+    """Cache LRU jawaban untuk teks OCR yang sudah dinormalisasi (normalize_for_search)
+
+    Kecocokan fuzzy hanya diterima jika himpunan kata isi (bukan stopword) sama
+    persis dan urutan token sensitif (angka, simbol matematika, IMPORTANT_WORDS)
+    identik; Jaccard >= min_similarity hanya menoleransi beda stopword dari OCR.
+    """
+
+    def __init__(self, maxsize: int, min_similarity: float):
+        self.maxsize = maxsize
+        self.min_similarity = min_similarity
+        self._entries: "OrderedDict[str, Tuple[FrozenSet[str], Tuple[FrozenSet[str], Tuple[str, ...]], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _profile(question_normalized: str) -> Tuple[FrozenSet[str], Tuple[FrozenSet[str], Tuple[str, ...]]]:
+        tokens = question_normalized.split()
+        content_words = frozenset(
+            token for token in tokens
+            if token not in STOPWORDS or token in IMPORTANT_WORDS
+        )
+        sensitive = tuple(
+            token for token in tokens
+            if token in IMPORTANT_WORDS or MATH_PATTERN.search(token)
+        )
+        return frozenset(tokens), (content_words, sensitive)
+
+    def get(self, question_normalized: str) -> Optional[str]:
+        if not question_normalized:
+            return None
+        with self._lock:
+            # Teks identik: lookup dict langsung
+            if question_normalized in self._entries:
+                self._entries.move_to_end(question_normalized)
+                return self._entries[question_normalized][2]
+
+        tokens, signature = self._profile(question_normalized)
+        with self._lock:
+            best_key, best_score = None, 0.0
+            for cached_key, (cached_tokens, cached_signature, _) in self._entries.items():
+                if cached_signature != signature:
+                    continue
+                score = len(tokens & cached_tokens) / len(tokens | cached_tokens)
+                if score > best_score:
+                    best_key, best_score = cached_key, score
+
+            if best_key is None or best_score < self.min_similarity:
+                return None
+            self._entries.move_to_end(best_key)
+            logger.info("Jawaban OCR diambil dari cache semantik (similarity %.3f)", best_score)
+            return self._entries[best_key][2]
+
+    def put(self, question_normalized: str, answer: str):
+        if not question_normalized:
+            return
+        tokens, signature = self._profile(question_normalized)
+        with self._lock:
+            self._entries[question_normalized] = (tokens, signature, answer)
+            self._entries.move_to_end(question_normalized)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+ocr_answer_cache = SemanticOCRCache(OCR_ANSWER_CACHE_SIZE, OCR_ANSWER_CACHE_MIN_SIMILARITY)
+
 # =======================
 # CSV PROCESSING
 # =======================
@@ -673,9 +1115,9 @@ def find_question_answer_columns(headers: List[str]) -> Tuple[List[int], List[in
     
     for i, header in enumerate(headers):
         header_lower = header.lower().strip()
-        if any(keyword in header_lower for keyword in ['question', 'soal', 'pertanyaan', 'ask']):
+        if any(keyword in header_lower for keyword in QUESTION_COLUMN_KEYWORDS):
             question_indices.append(i)
-        if any(keyword in header_lower for keyword in ['answer', 'jawaban', 'kunci', 'solusi', 'solution']):
+        if any(keyword in header_lower for keyword in ANSWER_COLUMN_KEYWORDS):
             answer_indices.append(i)
     
     return question_indices, answer_indices
@@ -690,7 +1132,7 @@ def process_csv_file(file_bytes: bytes) -> int:
         for encoding in encodings:
             try:
                 content = file_bytes.decode(encoding)
-                logger.info(f"CSV decoded dengan encoding: {encoding}")
+                logger.info("CSV decoded dengan encoding: %s", encoding)
                 break
             except UnicodeDecodeError:
                 continue
@@ -716,51 +1158,41 @@ def process_csv_file(file_bytes: bytes) -> int:
         question_cols, answer_cols = find_question_answer_columns(headers)
         
         if not question_cols or not answer_cols:
-            logger.error(f"Kolom tidak ditemukan. Headers: {headers}")
+            logger.error("Kolom tidak ditemukan. Headers: %s", headers)
             return 0
             
-        logger.info(f"Ditemukan kolom - Question: {question_cols[0]}, Answer: {answer_cols[0]}")
+        logger.info("Ditemukan kolom - Question: %s, Answer: %s", question_cols[0], answer_cols[0])
         
-        # Proses baris data
-        count_success = 0
+        # Kumpulkan pasangan sel; pembersihan dan validasi dilakukan sekali di build_soal_row
+        question_col, answer_col = question_cols[0], answer_cols[0]
+        min_length = max(question_col, answer_col) + 1
+        qa_pairs = []
         count_error = 0
         
         for row_num, row in enumerate(csv_reader, start=2):
-            try:
-                if len(row) > max(question_cols[0], answer_cols[0]):
-                    question = clean_text(row[question_cols[0]])
-                    answer = clean_text(row[answer_cols[0]])
-                    
-                    if question and answer and len(question) >= 3:
-                        if simpan_soal(question, answer, "csv_upload"):
-                            count_success += 1
-                        else:
-                            count_error += 1
-                    else:
-                        count_error += 1
-                        logger.debug(f"Baris {row_num} tidak valid: Q='{question}', A='{answer}'")
-                else:
-                    count_error += 1
-                    logger.debug(f"Baris {row_num} tidak memiliki kolom yang cukup")
-                    
-            except Exception as e:
+            if len(row) >= min_length:
+                qa_pairs.append((row[question_col], row[answer_col]))
+            else:
                 count_error += 1
-                logger.error(f"Error processing row {row_num}: {e}")
+                logger.debug("Baris %s tidak memiliki kolom yang cukup", row_num)
+        
+        # Simpan semua baris dengan satu load job dan satu MERGE
+        count_success = simpan_soal_bulk(qa_pairs, "csv_upload")
+        count_error += len(qa_pairs) - count_success
                 
-        logger.info(f"CSV processing complete: {count_success} sukses, {count_error} error")
+        logger.info("CSV processing complete: %s sukses, %s error", count_success, count_error)
         return count_success
         
     except Exception as e:
-        logger.error(f"Error processing CSV: {e}")
+        logger.error("Error processing CSV: %s", e)
         return 0
 
 def parse_qa_text(text: str) -> List[Tuple[str, str]]:
     """Parse teks untuk mengekstrak Q&A pairs"""
     questions_answers = []
     try:
-        # Pattern untuk Q: dan A:
-        pattern = r'(?i)(?:Q:|Pertanyaan:|Soal:)\s*(.*?)(?=(?:\n\s*(?:A:|Jawaban:)|\Z))(?:\s*(?:A:|Jawaban:)\s*(.*))?'
-        matches = re.findall(pattern, text, re.DOTALL)
+        # Pattern untuk Q: dan A: (semua penanda mengandung ':', lewati regex jika tidak ada)
+        matches = QA_PATTERN.findall(text) if ':' in text else []
         
         for match in matches:
             question = clean_text(match[0])
@@ -780,7 +1212,7 @@ def parse_qa_text(text: str) -> List[Tuple[str, str]]:
                         questions_answers.append((question, answer))
     
     except Exception as e:
-        logger.error(f"Error parsing Q&A text: {e}")
+        logger.error("Error parsing Q&A text: %s", e)
     
     return questions_answers
 
@@ -792,7 +1224,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /start"""
     try:
         user = update.effective_user
-        logger.info(f"User {user.username} ({user.id}) menggunakan /start")
+        logger.info("User %s (%s) menggunakan /start", user.username, user.id)
         
         welcome_text = (
             "Halo! Saya adalah bot pencari jawaban dengan akurasi tinggi.\n\n"
@@ -806,7 +1238,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(welcome_text)
     except Exception as e:
-        logger.error(f"Error di /start: {e}")
+        logger.error("Error di /start: %s", e)
         await update.message.reply_text("Terjadi error. Silakan coba lagi.")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -832,14 +1264,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(help_text)
     except Exception as e:
-        logger.error(f"Error di /help: {e}")
+        logger.error("Error di /help: %s", e)
         await update.message.reply_text("Terjadi error. Silakan coba lagi.")
 
 async def tambah_soal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /tambah"""
     try:
         user = update.effective_user
-        logger.info(f"User {user.username} ({user.id}) menggunakan /tambah")
+        logger.info("User %s (%s) menggunakan /tambah", user.username, user.id)
         
         if not context.args:
             await update.message.reply_text(
@@ -870,7 +1302,7 @@ async def tambah_soal(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Soal dan jawaban tidak boleh kosong.")
             return
         
-        if simpan_soal(question, answer, f"telegram_{user.id}"):
+        if await asyncio.to_thread(simpan_soal, question, answer, f"telegram_{user.id}"):
             await update.message.reply_text(
                 f"✅ Soal berhasil ditambahkan!\n\n"
                 f"Soal: {question}\n"
@@ -882,7 +1314,7 @@ async def tambah_soal(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
     except Exception as e:
-        logger.error(f"Error di /tambah: {e}")
+        logger.error("Error di /tambah: %s", e)
         await update.message.reply_text("Terjadi error saat menambah soal. Silakan coba lagi.")
 
 async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -899,7 +1331,7 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         question = " ".join(context.args)
         normalized = normalize_for_search(question)
-        keywords = extract_keywords(normalized)
+        keywords = extract_keywords(normalized, already_normalized=True)
         
         debug_text = (
             f"🔍 DEBUG NORMALISASI\n\n"
@@ -918,13 +1350,13 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Test pencarian
         if len(normalized) >= 3:
             await update.message.reply_chat_action(action="typing")
-            answer = find_answer_from_question(question)
+            answer = await asyncio.to_thread(find_answer_from_question, question)
             
             result_text = f"🎯 HASIL PENCARIAN:\n{answer}"
             await update.message.reply_text(result_text)
         
     except Exception as e:
-        logger.error(f"Error di /debug: {e}")
+        logger.error("Error di /debug: %s", e)
         await update.message.reply_text("Terjadi error saat debugging.")
 
 async def cari_jawaban_teks(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -932,7 +1364,7 @@ async def cari_jawaban_teks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
         question = update.message.text.strip()
-        logger.info(f"User {user.username} ({user.id}) bertanya: '{question}'")
+        logger.info("User %s (%s) bertanya: '%s'", user.username, user.id, question)
         
         if len(question) < 2:
             await update.message.reply_text(
@@ -949,11 +1381,11 @@ async def cari_jawaban_teks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Show typing indicator
         await update.message.reply_chat_action(action="typing")
         
-        # Cari jawaban
-        answer = find_answer_from_question(question)
+        # Cari jawaban (BigQuery dijalankan di thread agar event loop tidak terblokir)
+        answer = await asyncio.to_thread(find_answer_from_question, question)
         
         # Format response
-        if answer and answer != "Jawaban tidak ditemukan":
+        if answer and answer not in NON_ANSWER_MESSAGES:
             response = f"❓ Pertanyaan: {question}\n\n✅ Jawaban: {answer}"
         else:
             response = f"❓ Pertanyaan: {question}\n\n❌ {answer}"
@@ -961,7 +1393,7 @@ async def cari_jawaban_teks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(response)
         
     except Exception as e:
-        logger.error(f"Error mencari jawaban teks: {e}", exc_info=True)
+        logger.error("Error mencari jawaban teks: %s", e, exc_info=True)
         await update.message.reply_text(
             "Terjadi kesalahan saat mencari jawaban. Silakan coba lagi nanti."
         )
@@ -971,16 +1403,23 @@ async def cari_jawaban_gambar(update: Update, context: ContextTypes.DEFAULT_TYPE
     try:
         user = update.effective_user
         photo = update.message.photo[-1]
-        logger.info(f"User {user.username} ({user.id}) kirim gambar: {photo.file_id}")
+        logger.info("User %s (%s) kirim gambar: %s", user.username, user.id, photo.file_id)
         
-        await update.message.reply_chat_action(action="typing")
+        if is_photo_too_small(photo):
+            await update.message.reply_text(PHOTO_TOO_SMALL_MESSAGE)
+            return
+        
+        # Indikator typing dan metadata file diminta bersamaan
+        _, file = await asyncio.gather(
+            update.message.reply_chat_action(action="typing"),
+            context.bot.get_file(photo.file_id)
+        )
         
         # Download gambar
-        file = await context.bot.get_file(photo.file_id)
         file_bytes = await file.download_as_bytearray()
         
-        # Gunakan OCR.Space saja
-        ocr_text = ocr_with_ocr_space(bytes(file_bytes))
+        # Gunakan OCR.Space saja (HTTP blocking, jalankan di thread)
+        ocr_text = await asyncio.to_thread(ocr_with_ocr_space, file_bytes)
             
         if not ocr_text or len(ocr_text.strip()) < 3:
             await update.message.reply_text(
@@ -989,15 +1428,16 @@ async def cari_jawaban_gambar(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
         
-        logger.info(f"OCR hasil: '{ocr_text}'")
+        logger.info("OCR hasil: '%s'", ocr_text)
         
-        # Cari jawaban berdasarkan teks OCR
-        answer = find_answer_from_question(ocr_text)
+        # Teks OCR yang hampir sama dengan gambar sebelumnya memakai jawaban yang sama;
+        # scan cache semantik dan pencarian BigQuery sama-sama di thread
+        answer = await asyncio.to_thread(find_answer_from_question, ocr_text, ocr_answer_cache)
         
         # Format response
         response = f"📷 Teks terdeteksi: {ocr_text}\n\n"
         
-        if answer and answer != "Jawaban tidak ditemukan":
+        if answer and answer not in NON_ANSWER_MESSAGES:
             response += f"✅ Jawaban: {answer}"
         else:
             response += f"❌ {answer}"
@@ -1005,7 +1445,7 @@ async def cari_jawaban_gambar(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(response)
         
     except Exception as e:
-        logger.error(f"Error mencari jawaban gambar: {e}", exc_info=True)
+        logger.error("Error mencari jawaban gambar: %s", e, exc_info=True)
         await update.message.reply_text(
             "Terjadi error saat memproses gambar. Silakan coba lagi nanti."
         )
@@ -1014,7 +1454,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /ocr"""
     try:
         user = update.effective_user
-        logger.info(f"User {user.username} ({user.id}) menggunakan /ocr")
+        logger.info("User %s (%s) menggunakan /ocr", user.username, user.id)
         
         # Cek apakah ada gambar yang di-reply
         if not update.message.reply_to_message or not update.message.reply_to_message.photo:
@@ -1023,17 +1463,20 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        await update.message.reply_chat_action(action="typing")
-        
         # Dapatkan gambar dari pesan yang di-reply
         photo = update.message.reply_to_message.photo[-1]
+        if is_photo_too_small(photo):
+            await update.message.reply_text(PHOTO_TOO_SMALL_MESSAGE)
+            return
+        
+        await update.message.reply_chat_action(action="typing")
         
         # Download gambar
         file = await context.bot.get_file(photo.file_id)
         file_bytes = await file.download_as_bytearray()
         
-        # Gunakan OCR.Space saja
-        ocr_text = ocr_with_ocr_space(bytes(file_bytes))
+        # Gunakan OCR.Space saja (HTTP blocking, jalankan di thread)
+        ocr_text = await asyncio.to_thread(ocr_with_ocr_space, file_bytes)
             
         if not ocr_text:
             await update.message.reply_text("❌ Tidak dapat membaca teks dari gambar.")
@@ -1042,7 +1485,7 @@ async def ocr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"📄 Hasil OCR:\n\n{ocr_text}")
         
     except Exception as e:
-        logger.error(f"Error di /ocr: {e}", exc_info=True)
+        logger.error("Error di /ocr: %s", e, exc_info=True)
         await update.message.reply_text("Terjadi error saat melakukan OCR. Silakan coba lagi.")
 
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1052,7 +1495,7 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file = update.message.document
         filename = file.file_name
         file_size = file.file_size
-        logger.info(f"User {user.username} ({user.id}) upload: {filename} ({file_size} bytes)")
+        logger.info("User %s (%s) upload: %s (%s bytes)", user.username, user.id, filename, file_size)
         
         # Validasi file CSV
         if not filename or not filename.lower().endswith('.csv'):
@@ -1076,8 +1519,8 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_obj = await context.bot.get_file(file.file_id)
         file_bytes = await file_obj.download_as_bytearray()
         
-        # Proses file CSV
-        count_success = process_csv_file(file_bytes)
+        # Proses file CSV (parsing + BigQuery blocking, jalankan di thread)
+        count_success = await asyncio.to_thread(process_csv_file, file_bytes)
         
         if count_success > 0:
             await update.message.reply_text(
@@ -1094,7 +1537,7 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
     except Exception as e:
-        logger.error(f"Error handling file: {e}", exc_info=True)
+        logger.error("Error handling file: %s", e, exc_info=True)
         await update.message.reply_text(
             "❌ Terjadi error saat memproses file. Silakan coba lagi nanti."
         )
@@ -1116,7 +1559,7 @@ async def handle_text_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not filename or not filename.lower().endswith(('.txt', '.text')):
             return
         
-        logger.info(f"User {user.username} ({user.id}) upload file teks: {filename}")
+        logger.info("User %s (%s) upload file teks: %s", user.username, user.id, filename)
         
         await message.reply_chat_action(action="typing")
         await message.reply_text("⏳ Memproses file teks...")
@@ -1131,8 +1574,8 @@ async def handle_text_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except UnicodeDecodeError:
             content = file_bytes.decode('latin-1')
         
-        # Parse Q&A pairs
-        qa_pairs = parse_qa_text(content)
+        # Parse Q&A pairs (regex atas seluruh file, jalankan di thread)
+        qa_pairs = await asyncio.to_thread(parse_qa_text, content)
         
         if not qa_pairs:
             await message.reply_text(
@@ -1147,10 +1590,7 @@ async def handle_text_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Simpan ke database
-        count_success = 0
-        for question, answer in qa_pairs:
-            if simpan_soal(question, answer, f"text_file_{user.id}"):
-                count_success += 1
+        count_success = await asyncio.to_thread(simpan_soal_bulk, qa_pairs, f"text_file_{user.id}")
         
         await message.reply_text(
             f"✅ File teks berhasil diproses!\n"
@@ -1158,14 +1598,14 @@ async def handle_text_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     except Exception as e:
-        logger.error(f"Error handling text file: {e}", exc_info=True)
+        logger.error("Error handling text file: %s", e, exc_info=True)
         await update.message.reply_text(
             "❌ Terjadi error saat memproses file teks."
         )
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Global error handler"""
-    logger.error(f"Update {update} caused error {context.error}", exc_info=True)
+    logger.error("Update %s caused error %s", update, context.error, exc_info=True)
     
     if update and update.message:
         try:
@@ -1173,12 +1613,22 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "❌ Terjadi error tidak terduga. Silakan coba lagi atau hubungi admin."
             )
         except Exception as e:
-            logger.error(f"Error sending error message: {e}")
+            logger.error("Error sending error message: %s", e)
 
 # =======================
 # MAIN FUNCTION
 # =======================
 
+async def post_init(application: Application):
+    """Mulai refresh index TF-IDF setelah bot siap"""
+    global _corpus_refresh_task
+    _corpus_refresh_task = asyncio.create_task(refresh_corpus_periodically())
+
+async def post_shutdown(application: Application):
+    """Hentikan task refresh index saat bot berhenti"""
+    if _corpus_refresh_task:
+        _corpus_refresh_task.cancel()
+
 def main():
     """Fungsi utama untuk menjalankan bot"""
     try:
@@ -1193,7 +1643,15 @@ def main():
         initialize_services()
         
         # Buat application
-        application = Application.builder().token(TOKEN).build()
+        # concurrent_updates agar handler dari user berbeda bisa berjalan bersamaan
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .concurrent_updates(True)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         
         # Command handlers
         application.add_handler(CommandHandler("start", start))
@@ -1217,22 +1675,24 @@ def main():
             cari_jawaban_teks
         ))
         
-        # Error handler
-        application.add_error_handler(error_handler)
+        # Error handler; block=False agar balasan error dijalankan sebagai task
+        # terpisah (dilacak Application) dan tidak menahan pemrosesan update
+        application.add_error_handler(error_handler, block=False)
         
         # Jalankan bot
         logger.info("🤖 Bot sedang berjalan...")
         logger.info("Tekan Ctrl+C untuk menghentikan bot")
         
+        # Semua handler hanya memproses pesan baru; tipe update lain tidak perlu diminta
         application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
+            allowed_updates=[Update.MESSAGE],
             drop_pending_updates=True
         )
         
     except KeyboardInterrupt:
         logger.info("Bot dihentikan oleh user")
     except Exception as e:
-        logger.error(f"Error in main: {e}", exc_info=True)
+        logger.error("Error in main: %s", e, exc_info=True)
     finally:
         logger.info("Bot shutdown complete")
 